@@ -5,70 +5,176 @@ Runs inference benchmarks and extracts runtime metrics
 from llama.cpp logs.
 """
 
+import http.client
+import itertools
+import json
+import mmap
+import os
+import signal
+import socket
 import subprocess
-import re
-from typing import Dict, List
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from llama_parse import parse_llama_output
+
+
+# Metrics averaged into the result row, in output column order
+_AGG_KEYS = ["Load_s", "Eval_s", "TPS", "RuntimeRAM_MB"]
 
 
 # ---------------------------
-# Parsing utilities
+# Helpers
 # ---------------------------
 
-def parse_llama_output(output: str) -> Dict[str, float]:
+def _iter_prompts(prompt_file: str) -> Iterator[str]:
     """
-    Parse llama-cli output and extract runtime metrics.
+    Yield non-empty, stripped prompts (one per line) from a text file.
 
-    Returns:
-        Dictionary with timing and memory estimates.
+    The file is memory-mapped and sliced line by line, so prompts are
+    decoded only as they are consumed.
     """
 
-    metrics = {
-        "Load_s": 0.0,
-        "Eval_s": 0.0,
-        "TPS": 0.0,
-        "ModelRAM_MB": 0.0,
-        "KVCache_MB": 0.0,
-        "RuntimeRAM_MB": 0.0,
-    }
+    with open(prompt_file, "rb") as f:
+        # mmap refuses zero-length files
+        if os.fstat(f.fileno()).st_size == 0:
+            return
 
-    # Load time
-    m = re.search(r"load time\s*=\s*([\d\.]+)\s*ms", output)
-    if m:
-        metrics["Load_s"] = float(m.group(1)) / 1000.0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start = 0
+            while start < size:
+                nl = mm.find(b"\n", start)
+                end = nl if nl != -1 else size
+                line = mm[start:end].strip()
+                if line:
+                    yield line.decode("utf-8")
+                start = end + 1
 
-    # Eval time + TPS
-    for line in output.splitlines():
-        if "eval time" in line and "prompt eval" not in line:
-            m_eval = re.search(r"eval time\s*=\s*([\d\.]+)\s*ms", line)
-            if m_eval:
-                metrics["Eval_s"] = float(m_eval.group(1)) / 1000.0
 
-            m_tps = re.search(r"([\d\.]+)\s*(?:tok/s|tokens per second)", line)
-            if m_tps:
-                metrics["TPS"] = float(m_tps.group(1))
-            break
+def _load_prompts(prompt_file: str) -> Iterator[str]:
+    """
+    Return a prompt stream, failing early if the file has no prompts.
+    """
 
-    # Model size
-    m_model = re.search(r"model size\s*=\s*([\d\.]+)\s*MB", output)
-    if m_model:
-        metrics["ModelRAM_MB"] = float(m_model.group(1))
+    prompts = _iter_prompts(prompt_file)
+    first = next(prompts, None)
+
+    if first is None:
+        raise ValueError("Prompt file is empty.")
 
-    # KV cache
-    m_kv = re.search(r"KV cache\s*=\s*([\d\.]+)\s*MB", output)
-    if m_kv:
-        metrics["KVCache_MB"] = float(m_kv.group(1))
+    return itertools.chain([first], prompts)
 
-    metrics["RuntimeRAM_MB"] = (
-        metrics["ModelRAM_MB"] + metrics["KVCache_MB"]
+
+def _aggregate(model_name: str, all_metrics: List[Dict]) -> List[Dict]:
+    """
+    Average per-prompt metrics into a single result row.
+    """
+
+    # N prompts x K metrics, reduced in one vectorised call
+    arr = np.array(
+        [[m[k] for k in _AGG_KEYS] for m in all_metrics],
+        dtype=np.float64,
     )
+    avg = dict(zip(_AGG_KEYS, arr.mean(axis=0).tolist()))
 
-    return metrics
+    return [{
+        "Model": model_name,
+        **avg,
+        "NumParams_B": None,  # optional, can be filled later
+    }]
 
 
 # ---------------------------
 # Benchmark runner
 # ---------------------------
 
+def _run_one(
+    prompt: str,
+    model_path: str,
+    llama_cli_path: str,
+    *,
+    context_size: int,
+    max_tokens: int,
+    ngl_layers: int,
+    temperature: float,
+    threads: int,
+    timeout: float,
+) -> Dict:
+    """
+    Run llama-cli on a single prompt and return the parsed metrics.
+
+    If llama-cli does not finish within timeout seconds, its whole
+    process group (process tree on Windows) is killed and a zeroed
+    row marked Status="timeout" is returned instead.
+    """
+
+    cmd = [
+        llama_cli_path,
+        "-m", model_path,
+        "-p", prompt,
+        "-n", str(max_tokens),
+        "-c", str(context_size),
+        "--temp", str(temperature),
+        "--ignore-eos",
+        "--no-warmup",
+    ]
+
+    if threads > 0:
+        cmd.extend(["-t", str(threads)])
+
+    if ngl_layers > 0:
+        cmd.extend(["-ngl", str(ngl_layers)])
+
+    # Own process group, so a wedged llama-cli and any children
+    # can be killed together on timeout
+    if os.name == "nt":
+        group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group = {"start_new_session": True}
+
+    # llama.cpp prints timings and memory info on stderr; stdout only
+    # carries the generated text, so it is discarded instead of buffered
+    # and decoded.
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        bufsize=65536,
+        **group,
+    ) as proc:
+        try:
+            _, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if os.name == "nt":
+                # Kill the whole process tree, not only llama-cli
+                subprocess.run(
+                    ["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+
+            print(f"[WARN] llama-cli timed out after {timeout:.0f} s")
+            metrics = dict.fromkeys(_AGG_KEYS, 0.0)
+            metrics["Status"] = "timeout"
+            return metrics
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, stderr=stderr
+        )
+
+    return parse_llama_output(stderr)
+
+
 def run_llama_benchmark(
     model_name: str,
     model_path: str,
@@ -79,55 +185,293 @@ def run_llama_benchmark(
     max_tokens: int = 128,
     ngl_layers: int = 0,
     temperature: float = 0.7,
+    num_workers: int = 1,
+    timeout: Optional[float] = None,
 ) -> List[Dict]:
     """
     Run benchmark on all prompts and return aggregated metrics.
+
+    With num_workers > 1, prompts are run concurrently and the CPU
+    threads given to each llama-cli process are split accordingly.
+
+    Each prompt is bounded by timeout seconds (default: derived from
+    max_tokens); timed-out prompts are left out of the averages.
     """
 
-    with open(prompt_file, "r", encoding="utf-8") as f:
-        prompts = [p.strip() for p in f if p.strip()]
+    if num_workers < 1:
+        raise ValueError("num_workers must be >= 1.")
 
-    if not prompts:
-        raise ValueError("Prompt file is empty.")
+    prompts = _load_prompts(prompt_file)
 
-    all_metrics = []
+    # Generous bound: even ~1 tok/s finishes well within it
+    if timeout is None:
+        timeout = max(60.0, max_tokens * 2.0)
 
-    for prompt in prompts:
-        cmd = [
-            llama_cli_path,
-            "-m", model_path,
-            "-p", prompt,
-            "-n", str(max_tokens),
-            "-c", str(context_size),
-            "--temp", str(temperature),
-            "--ignore-eos",
-            "--no-warmup",
-        ]
-
-        if ngl_layers > 0:
-            cmd.extend(["-ngl", str(ngl_layers)])
-
-        proc = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="ignore",
-            check=True,
-        )
+    # Each llama-cli is an external process, so threads are enough here:
+    # the GIL is released while waiting on the subprocess.
+    run = partial(
+        _run_one,
+        model_path=model_path,
+        llama_cli_path=llama_cli_path,
+        context_size=context_size,
+        max_tokens=max_tokens,
+        ngl_layers=ngl_layers,
+        temperature=temperature,
+        timeout=timeout,
+        # Avoid oversubscribing the CPU when several prompts run at once
+        threads=(
+            max(1, (os.cpu_count() or 1) // num_workers)
+            if num_workers > 1 else -1
+        ),
+    )
+
+    if num_workers == 1:
+        all_metrics = [run(prompt) for prompt in prompts]
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as ex:
+            all_metrics = list(ex.map(run, prompts))
+
+    # Zeroed timeout rows would drag the averages down
+    completed = [m for m in all_metrics if m.get("Status") != "timeout"]
+    if not completed:
+        raise RuntimeError("llama-cli timed out on every prompt.")
+
+    return _aggregate(model_name, completed)
+
+
+def run_llama_bench(
+    model_name: str,
+    model_path: str,
+    llama_bench_path: str,
+    *,
+    n_prompt: int = 512,
+    max_tokens: int = 128,
+    ngl_layers: int = 0,
+    repetitions: int = 5,
+) -> List[Dict]:
+    """
+    Benchmark a model with a single llama-bench invocation.
 
-        output = proc.stdout + proc.stderr
-        metrics = parse_llama_output(output)
-        all_metrics.append(metrics)
+    The model is loaded once and all repetitions run in the same
+    process, so per-prompt start-up cost does not leak into the
+    averages. llama-bench uses synthetic prompts of n_prompt tokens.
 
-    # Aggregate across prompts
-    avg = lambda k: sum(m[k] for m in all_metrics) / len(all_metrics)
+    llama-bench reports neither load time nor KV cache size, so Load_s
+    and RuntimeRAM_MB are left empty (None) rather than filled with
+    values that mean something else than in the other runners.
+    """
+
+    cmd = [
+        llama_bench_path,
+        "-m", model_path,
+        "-p", str(n_prompt),
+        "-n", str(max_tokens),
+        "-r", str(repetitions),
+        "-ngl", str(ngl_layers),
+        "-o", "json",
+    ]
+
+    proc = subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="ignore",
+        check=True,
+    )
+
+    records = json.loads(proc.stdout)
+
+    # One record per test: prompt processing (n_gen == 0)
+    # and text generation (n_prompt == 0)
+    gen = next((r for r in records if r.get("n_gen", 0) > 0), None)
+    if gen is None:
+        raise RuntimeError("No generation test found in llama-bench output.")
 
     return [{
         "Model": model_name,
-        "Load_s": avg("Load_s"),
-        "Eval_s": avg("Eval_s"),
-        "TPS": avg("TPS"),
-        "RuntimeRAM_MB": avg("RuntimeRAM_MB"),
-        "NumParams_B": None,  # optional, can be filled later
+        "Load_s": None,
+        "Eval_s": gen["avg_ns"] / 1e9,
+        "TPS": gen["avg_ts"],
+        "RuntimeRAM_MB": None,
+        "NumParams_B": gen["model_n_params"] / 1e9,
     }]
+
+
+# ---------------------------
+# llama-server runner
+# ---------------------------
+
+def _free_port() -> int:
+    """
+    Ask the OS for a currently unused local TCP port.
+    """
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request_json(
+    conn: http.client.HTTPConnection,
+    method: str,
+    path: str,
+    payload: Optional[Dict] = None,
+) -> Tuple[int, Dict]:
+    """
+    Send a JSON request on a persistent connection and decode the reply.
+    """
+
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(
+        method, path, body=body,
+        headers={"Content-Type": "application/json"},
+    )
+    resp = conn.getresponse()
+    data = resp.read()
+    return resp.status, (json.loads(data) if data else {})
+
+
+def _log_tail(log: IO[bytes], max_bytes: int = 4096) -> str:
+    """
+    Return the last max_bytes of a log file, decoded for display.
+    """
+
+    log.seek(0, os.SEEK_END)
+    log.seek(max(0, log.tell() - max_bytes))
+    return log.read().decode("utf-8", errors="ignore")
+
+
+def _wait_for_server(
+    conn: http.client.HTTPConnection,
+    server: subprocess.Popen,
+    timeout: float,
+    log: IO[bytes],
+) -> None:
+    """
+    Poll /health until llama-server has loaded the model.
+
+    If the server exits first, the tail of its log is included in the
+    error, since that is where llama.cpp reports why.
+    """
+
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(
+                f"llama-server exited with code {server.returncode}:\n"
+                f"{_log_tail(log)}"
+            )
+
+        try:
+            status, _ = _request_json(conn, "GET", "/health")
+            if status == 200:
+                return
+        except (ConnectionError, http.client.HTTPException):
+            # Not listening yet: drop the socket and retry
+            conn.close()
+
+        time.sleep(0.25)
+
+    raise RuntimeError(f"llama-server not ready after {timeout:.0f} s")
+
+
+def run_llama_server_benchmark(
+    model_name: str,
+    model_path: str,
+    prompt_file: str,
+    llama_server_path: str,
+    *,
+    context_size: int = 2048,
+    max_tokens: int = 128,
+    ngl_layers: int = 0,
+    temperature: float = 0.7,
+    port: Optional[int] = None,
+    startup_timeout: float = 300.0,
+) -> List[Dict]:
+    """
+    Run benchmark on all prompts through a single llama-server instance.
+
+    The model is loaded once; every prompt is sent as a /completion
+    request over the same keep-alive connection and timings are read
+    from the JSON response. Load_s is the load time llama.cpp reports
+    in the server log, as for llama-cli, or empty (None) if it is not
+    reported.
+
+    By default the server listens on a free port, so /health can never
+    be answered by an unrelated service.
+    """
+
+    prompts = _load_prompts(prompt_file)
+
+    if port is None:
+        port = _free_port()
+
+    cmd = [
+        llama_server_path,
+        "-m", model_path,
+        "-c", str(context_size),
+        "--host", "127.0.0.1",
+        "--port", str(port),
+    ]
+
+    if ngl_layers > 0:
+        cmd.extend(["-ngl", str(ngl_layers)])
+
+    all_metrics = []
+
+    # Server logs go to a temp file (a pipe could fill up and stall
+    # the server); load time and memory info are parsed from it after
+    # shutdown.
+    with tempfile.TemporaryFile() as log:
+        server = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=log,
+        )
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+
+        try:
+            _wait_for_server(conn, server, startup_timeout, log)
+
+            for prompt in prompts:
+                status, reply = _request_json(conn, "POST", "/completion", {
+                    "prompt": prompt,
+                    "n_predict": max_tokens,
+                    "temperature": temperature,
+                    "ignore_eos": True,
+                })
+                if status != 200:
+                    raise RuntimeError(
+                        f"llama-server returned HTTP {status}: {reply}"
+                    )
+
+                timings = reply["timings"]
+                all_metrics.append({
+                    "Eval_s": timings["predicted_ms"] / 1000.0,
+                    "TPS": timings["predicted_per_second"],
+                })
+        finally:
+            conn.close()
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+
+        log.seek(0)
+        memory = parse_llama_output(log.read())
+
+    for m in all_metrics:
+        m["Load_s"] = memory["Load_s"]
+        m["RuntimeRAM_MB"] = memory["RuntimeRAM_MB"]
+
+    rows = _aggregate(model_name, all_metrics)
+
+    # No load time in the log: leave the column empty rather than 0
+    if not memory["Load_s"]:
+        rows[0]["Load_s"] = None
+
+    return rows
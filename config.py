@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # =========================
@@ -28,6 +29,9 @@ MODELS_DIR = PROJECT_ROOT / "models"
 RESULTS_CSV = RESULTS_DIR / "results.csv"
 PPL_CSV = RESULTS_DIR / "perplexity.csv"
 
+# Cache dei valori PPL gia' calcolati (vedi ppl.py)
+PPL_CACHE = RESULTS_DIR / "ppl_cache.json"
+
 PROMPT_FILE = PROJECT_ROOT / "prompt.txt"
 
 
@@ -37,21 +41,36 @@ PROMPT_FILE = PROJECT_ROOT / "prompt.txt"
 
 # Directory root di llama.cpp (buildata manualmente)
 LLAMA_CPP_ROOT = Path.home() / "llama.cpp"
+LLAMA_BIN_DIR = LLAMA_CPP_ROOT / "build" / "bin"
 
-if not LLAMA_CPP_ROOT.exists():
-    raise RuntimeError(
-        f"llama.cpp not found at {LLAMA_CPP_ROOT}. "
-        "Please update LLAMA_CPP_ROOT in config.py"
-    )
-
-LLAMA_CLI = LLAMA_CPP_ROOT / "build" / "bin" / "llama-cli"
-LLAMA_PPL = LLAMA_CPP_ROOT / "build" / "bin" / "llama-perplexity"
-LLAMA_QUANTIZE = LLAMA_CPP_ROOT / "build" / "bin" / "llama-quantize"
+LLAMA_CLI = LLAMA_BIN_DIR / "llama-cli"
+LLAMA_PPL = LLAMA_BIN_DIR / "llama-perplexity"
+LLAMA_QUANTIZE = LLAMA_BIN_DIR / "llama-quantize"
+LLAMA_BENCH = LLAMA_BIN_DIR / "llama-bench"
+LLAMA_SERVER = LLAMA_BIN_DIR / "llama-server"
 CONVERT_SCRIPT = LLAMA_CPP_ROOT / "convert_hf_to_gguf.py"
 
-for p in [LLAMA_CLI, LLAMA_PPL, LLAMA_QUANTIZE, CONVERT_SCRIPT]:
-    if not p.exists():
-        raise RuntimeError(f"Missing llama.cpp component: {p}")
+# Verifica dei componenti: una sola scansione di build/bin invece di
+# uno stat() per file. Saltata se LLM_BENCH_SKIP_CHECKS vale "1".
+if os.environ.get("LLM_BENCH_SKIP_CHECKS") != "1":
+    if not LLAMA_CPP_ROOT.exists():
+        raise RuntimeError(
+            f"llama.cpp not found at {LLAMA_CPP_ROOT}. "
+            "Please update LLAMA_CPP_ROOT in config.py"
+        )
+
+    try:
+        with os.scandir(LLAMA_BIN_DIR) as it:
+            present = {entry.name for entry in it}
+    except FileNotFoundError:
+        present = set()
+
+    for p in [LLAMA_CLI, LLAMA_PPL, LLAMA_QUANTIZE]:
+        if p.name not in present:
+            raise RuntimeError(f"Missing llama.cpp component: {p}")
+
+    if not CONVERT_SCRIPT.exists():
+        raise RuntimeError(f"Missing llama.cpp component: {CONVERT_SCRIPT}")
 
 
 # =========================
@@ -4,24 +4,25 @@ Utilities for downloading and preparing LLMs from Hugging Face.
 This module handles:
 - model download from Hugging Face
 - conversion to GGUF format
-- optional quantisation
+- optional quantisation (one type, or several concurrently)
 
 Authentication is NOT handled here.
 If a model is gated, the user must login beforehand using:
     huggingface-cli login
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import os
 import subprocess
 import sys
 
-from huggingface_hub import snapshot_download, HfHubHTTPError
-
 from config import (
     MODELS_DIR,
     LLAMA_CPP_ROOT,
     LLAMA_QUANTIZE,
     CONVERT_SCRIPT,
+    SUPPORTED_QUANTS,
 )
 
 
@@ -29,6 +30,10 @@ from config import (
 # Hugging Face download
 # ---------------------------
 
+# Written into the model directory once a download has completed
+DOWNLOAD_MARKER = ".download_complete"
+
+
 def download_model_from_hf(
     model_id: str,
     *,
@@ -37,18 +42,36 @@ def download_model_from_hf(
     """
     Download a Hugging Face model repository locally.
 
+    A marker file recording the revision is written after a successful
+    download; if it matches on later calls, the local copy is returned
+    without contacting the Hub.
+
     Returns the local path to the downloaded model.
     """
 
+    local_dir = MODELS_DIR / model_id.replace("/", "__")
+    marker = local_dir / DOWNLOAD_MARKER
+
+    if marker.exists() and marker.read_text() == (revision or ""):
+        return local_dir
+
+    # Deferred: huggingface_hub is slow to import and only needed here
+    from huggingface_hub import snapshot_download, HfHubHTTPError
+
     MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
+    # Invalidate first: a download that fails part-way must not leave
+    # the directory marked complete for the previous revision
+    marker.unlink(missing_ok=True)
+
     try:
         local_path = snapshot_download(
             repo_id=model_id,
             revision=revision,
-            local_dir=MODELS_DIR / model_id.replace("/", "__"),
+            local_dir=local_dir,
             local_dir_use_symlinks=False,
         )
+        marker.write_text(revision or "")
         return Path(local_path)
 
     except HfHubHTTPError as e:
@@ -104,6 +127,8 @@ def quantise_gguf(
     gguf_path: Path,
     quant_type: str,
     output_path: Path,
+    *,
+    threads: int | None = None,
 ) -> Path:
     """
     Quantise a GGUF model using llama.cpp.
@@ -121,5 +146,55 @@ def quantise_gguf(
         quant_type,
     ]
 
+    if threads is not None:
+        cmd.append(str(threads))
+
     subprocess.run(cmd, check=True)
-    return output_path
\ No newline at end of file
+    return output_path
+
+
+def prepare_all_quants(
+    f16_path: Path,
+    output_dir: Path,
+    *,
+    quants: list[str] | None = None,
+    max_workers: int = 2,
+) -> dict[str, Path]:
+    """
+    Quantise an F16 GGUF model into several types concurrently.
+
+    Each quantisation of the same source is independent, so they run
+    in parallel. llama-quantize is itself multi-threaded, so CPU threads
+    are split across workers. Keep max_workers low on slow disks.
+
+    Returns a mapping from quantisation type to GGUF path.
+    """
+
+    quants = SUPPORTED_QUANTS if quants is None else quants
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # F16 is produced by the HF -> GGUF conversion itself
+    outputs = {"F16": f16_path} if "F16" in quants else {}
+    todo = [q for q in quants if q != "F16"]
+
+    if not todo:
+        return outputs
+
+    max_workers = max(1, min(max_workers, len(todo)))
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {
+            q: ex.submit(
+                quantise_gguf,
+                f16_path,
+                q,
+                output_dir / f"{f16_path.stem}-{q}.gguf",
+                threads=threads,
+            )
+            for q in todo
+        }
+        for q, fut in futures.items():
+            outputs[q] = fut.result()
+
+    return outputs
\ No newline at end of file
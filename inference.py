@@ -20,9 +20,12 @@ def run_llama(
     max_tokens: int = 128,
     threads: int = -1,
     ngl_layers: int = 0,
-) -> str:
+) -> bytes:
     """
     Run llama-cli and return raw output (stdout + stderr).
+
+    The output is returned undecoded, as llama_parse.parse_llama_output
+    expects.
     """
 
     if not LLAMA_CLI.exists():
@@ -45,9 +48,6 @@ def run_llama(
     result = subprocess.run(
         cmd,
         capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="ignore",
         check=True,
     )
 
@@ -0,0 +1,76 @@
+"""
+Parsing utilities for llama.cpp logs.
+
+Holds the compiled patterns used to extract timing and memory
+metrics, so every module parsing llama-cli output shares them.
+"""
+
+import re
+from typing import Dict
+
+
+# ---------------------------
+# Compiled patterns
+# ---------------------------
+
+LOAD = re.compile(rb"load time\s*=\s*([\d\.]+)\s*ms")
+
+# Generation line only ("prompt eval" lines are skipped):
+# eval time and TPS in one match
+EVAL = re.compile(
+    rb"^(?!.*prompt eval).*eval time\s*=\s*(?P<ms>[\d\.]+)\s*ms"
+    rb"(?:.*?(?P<tps>[\d\.]+)\s*(?:tok/s|tokens per second))?",
+    re.MULTILINE,
+)
+
+MODEL_SIZE = re.compile(rb"model size\s*=\s*([\d\.]+)\s*MB")
+KV_CACHE = re.compile(rb"KV cache\s*=\s*([\d\.]+)\s*MB")
+
+
+# ---------------------------
+# Parsing utilities
+# ---------------------------
+
+def parse_llama_output(output: bytes) -> Dict[str, float]:
+    """
+    Parse raw llama-cli output and extract runtime metrics.
+
+    Works on raw bytes, so the log is never decoded; float() accepts
+    the matched bytes directly.
+
+    Returns:
+        Dictionary with timing and memory estimates.
+    """
+
+    load_s = eval_s = tps = model_mb = kv_mb = 0.0
+
+    # Cheap substring checks gate each regex: most of the output is
+    # generated text and log noise that never matches.
+
+    # Load time
+    if b"load time" in output and (m := LOAD.search(output)):
+        load_s = float(m.group(1)) / 1000.0
+
+    # Eval time + TPS (single pass over the whole output)
+    if b"eval time" in output and (m := EVAL.search(output)):
+        ev = m.groupdict()
+        eval_s = float(ev["ms"]) / 1000.0
+        if ev["tps"]:
+            tps = float(ev["tps"])
+
+    # Model size
+    if b"model size" in output and (m := MODEL_SIZE.search(output)):
+        model_mb = float(m.group(1))
+
+    # KV cache
+    if b"KV cache" in output and (m := KV_CACHE.search(output)):
+        kv_mb = float(m.group(1))
+
+    return {
+        "Load_s": load_s,
+        "Eval_s": eval_s,
+        "TPS": tps,
+        "ModelRAM_MB": model_mb,
+        "KVCache_MB": kv_mb,
+        "RuntimeRAM_MB": model_mb + kv_mb,
+    }
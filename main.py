@@ -2,16 +2,24 @@
 Main wrapper for the LLM Edge Benchmark pipeline.
 
 Provides an interactive CLI menu to:
-- prepare models (download, convert, quantise) [WIP]
-- run benchmarks via llama-cli
+- prepare models (download, convert, quantise)
+- run benchmarks via llama-cli, llama-server or llama-bench
 - compute perplexity (PPL)
 - generate comparison plots
+
+The same steps can be run non-interactively, e.g.:
+    python main.py --action bench --models models/gguf/foo-Q4_K_M.gguf
+    python main.py --action bench --runner server --models foo.gguf
+    python main.py --action ppl --gpus 0 1 --models a.gguf b.gguf
+    python main.py --action all --models org/name --quants Q8_0 Q4_K_M
 """
 
+import argparse
 import sys
 import csv
+from operator import itemgetter
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
 from config import (
     SUPPORTED_QUANTS,
@@ -19,12 +27,28 @@ from config import (
     PPL_CSV,
     PROMPT_FILE,
     DATA_DIR,
+    MODELS_DIR,
     LLAMA_CLI,
+    LLAMA_SERVER,
+    LLAMA_BENCH,
 )
 
-from benchmark_cli import run_llama_benchmark
-from plots import generate_basic_plots
-from ppl import compute_ppl
+# Heavy modules (numpy, pandas/matplotlib) are imported inside the
+# menu actions that need them, so the menu starts instantly.
+
+# Columns of RESULTS_CSV (keys of the rows returned by the runners)
+RESULTS_FIELDS = [
+    "Model",
+    "Load_s",
+    "Eval_s",
+    "TPS",
+    "RuntimeRAM_MB",
+    "NumParams_B",
+]
+
+# Benchmark back-ends: llama-cli per prompt, one llama-server, or
+# llama-bench (synthetic prompts; Load_s and RuntimeRAM_MB left empty)
+RUNNERS = ["cli", "server", "bench"]
 
 
 # ---------------------------
@@ -39,7 +63,7 @@ def print_header():
 
 def print_menu():
     print("1) Prepare model (download, convert, quantise)")
-    print("2) Run benchmark (llama-cli)")
+    print("2) Run benchmark")
     print("3) Compute perplexity (PPL)")
     print("4) Generate plots")
     print("5) Run full pipeline (1 → 4)")
@@ -58,17 +82,276 @@ def ask_list(prompt: str) -> List[str]:
     return [x.strip() for x in raw.split(",") if x.strip()]
 
 
+# ---------------------------
+# Pipeline steps
+# ---------------------------
+# Non-interactive building blocks shared by the menu and the CLI.
+# They raise on failure instead of printing.
+
+def prepare_run(model_id: str, quants: List[str]) -> Dict[str, Path]:
+    """
+    Download a Hugging Face model, convert it to GGUF and quantise it.
+
+    Returns a mapping from quantisation type to GGUF path.
+    """
+
+    from hf_utils import (
+        download_model_from_hf,
+        convert_to_gguf,
+        prepare_all_quants,
+    )
+
+    name = model_id.split("/")[-1]
+    gguf_dir = MODELS_DIR / "gguf"
+    gguf_dir.mkdir(parents=True, exist_ok=True)
+
+    model_dir = download_model_from_hf(model_id)
+    f16_path = convert_to_gguf(model_dir, gguf_dir / f"{name}.gguf")
+
+    return prepare_all_quants(f16_path, gguf_dir, quants=quants)
+
+
+def benchmark_run(
+    model_name: str,
+    model_path: Path,
+    *,
+    ngl_layers: int = 0,
+    num_workers: int = 1,
+    runner: str = "cli",
+) -> List[Dict]:
+    """
+    Benchmark a GGUF model and append the results to RESULTS_CSV.
+
+    runner "cli" starts llama-cli once per prompt; "server" loads the
+    model once in llama-server and sends it every prompt; "bench" runs
+    llama-bench on synthetic prompts. num_workers only applies to "cli".
+    """
+
+    from benchmark_cli import (
+        run_llama_benchmark,
+        run_llama_server_benchmark,
+        run_llama_bench,
+    )
+
+    if runner == "cli":
+        results = run_llama_benchmark(
+            model_name=model_name,
+            model_path=str(model_path),
+            prompt_file=str(PROMPT_FILE),
+            llama_cli_path=str(LLAMA_CLI),
+            ngl_layers=ngl_layers,
+            num_workers=num_workers,
+        )
+    elif runner == "server":
+        if not LLAMA_SERVER.exists():
+            raise FileNotFoundError(
+                f"llama-server not found at {LLAMA_SERVER}"
+            )
+        results = run_llama_server_benchmark(
+            model_name=model_name,
+            model_path=str(model_path),
+            prompt_file=str(PROMPT_FILE),
+            llama_server_path=str(LLAMA_SERVER),
+            ngl_layers=ngl_layers,
+        )
+    elif runner == "bench":
+        if not LLAMA_BENCH.exists():
+            raise FileNotFoundError(
+                f"llama-bench not found at {LLAMA_BENCH}"
+            )
+        results = run_llama_bench(
+            model_name=model_name,
+            model_path=str(model_path),
+            llama_bench_path=str(LLAMA_BENCH),
+            ngl_layers=ngl_layers,
+        )
+    else:
+        raise ValueError(f"Unknown benchmark runner: {runner}")
+
+    with open(RESULTS_CSV, "a", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+
+        # Append mode starts at the end: position 0 means the file is
+        # new or empty and still needs a header
+        if csvfile.tell() == 0:
+            writer.writerow(RESULTS_FIELDS)
+
+        # Fixed column order: rows become tuples without a per-row
+        # dict -> list conversion
+        writer.writerows(map(itemgetter(*RESULTS_FIELDS), results))
+
+    return results
+
+
+def ppl_run(
+    model_name: str,
+    model_path: Path,
+    *,
+    ngl_layers: int = 0,
+    auto_ngl: bool = False,
+) -> Dict[str, float]:
+    """
+    Compute perplexity of a GGUF model and append it to PPL_CSV.
+
+    Returns the full metrics dictionary; only PPL is written to the CSV.
+    """
+
+    from ppl import compute_ppl
+
+    metrics = compute_ppl(
+        model_path=model_path,
+        ngl_layers=ngl_layers,
+        auto_ngl=auto_ngl,
+    )
+
+    append_ppl_rows([(model_name, metrics)])
+    return metrics
+
+
+def ppl_batch_run(
+    model_paths: List[Path],
+    *,
+    ngl_layers: int = 0,
+    auto_ngl: bool = False,
+    gpus: List[int] | None = None,
+) -> Dict[Path, Dict[str, float]]:
+    """
+    Compute perplexity of several GGUF models and append them to PPL_CSV.
+
+    Every model path is checked before the first (long) run. Models are
+    labelled by file stem. If gpus is given, models run concurrently,
+    one per GPU.
+    """
+
+    from ppl import compute_ppl_batch, compute_ppl_many
+
+    if gpus:
+        results = compute_ppl_many(
+            model_paths,
+            gpus,
+            ngl_layers=ngl_layers,
+            auto_ngl=auto_ngl,
+        )
+    else:
+        results = compute_ppl_batch(
+            model_paths,
+            ngl_layers=ngl_layers,
+            auto_ngl=auto_ngl,
+        )
+
+    append_ppl_rows([(p.stem, m) for p, m in results.items()])
+    return results
+
+
+def append_ppl_rows(rows: List[Tuple[str, Dict[str, float]]]):
+    """
+    Append (model name, metrics) pairs to PPL_CSV.
+    """
+
+    with open(PPL_CSV, "a", newline="", encoding="utf-8") as csvfile:
+        writer = csv.DictWriter(
+            csvfile,
+            fieldnames=["Model", "PPL"]
+        )
+
+        if csvfile.tell() == 0:
+            writer.writeheader()
+
+        writer.writerows(
+            {"Model": name, "PPL": metrics["PPL"]} for name, metrics in rows
+        )
+
+
+def plots_run():
+    """
+    Generate comparison plots from RESULTS_CSV and PPL_CSV.
+    """
+
+    for path in (RESULTS_CSV, PPL_CSV):
+        if not path.exists():
+            raise FileNotFoundError(f"Results file not found: {path}")
+
+    from plots import generate_basic_plots
+
+    generate_basic_plots(
+        results_csv=RESULTS_CSV,
+        ppl_csv=PPL_CSV,
+        output_dir=DATA_DIR / "plots",
+    )
+
+
+def pipeline_run(
+    model_ids: List[str],
+    quants: List[str],
+    *,
+    ngl_layers: int = 0,
+    num_workers: int = 1,
+    runner: str = "cli",
+):
+    """
+    Prepare, benchmark and evaluate every (model, quant) pair, then plot.
+    """
+
+    for model_id in model_ids:
+        for quant, gguf_path in prepare_run(model_id, quants).items():
+            label = f"{model_id.split('/')[-1]}-{quant}"
+            benchmark_run(
+                label,
+                gguf_path,
+                ngl_layers=ngl_layers,
+                num_workers=num_workers,
+                runner=runner,
+            )
+            ppl_run(label, gguf_path, ngl_layers=ngl_layers)
+
+    plots_run()
+
+
 # ---------------------------
 # Menu actions
 # ---------------------------
 
+def ask_ngl(prompt: str) -> int | None:
+    try:
+        return int(input(prompt).strip() or 0)
+    except ValueError:
+        print("Invalid number for GPU layers.")
+        return None
+
+
+def ask_runner() -> str | None:
+    choices = "/".join(RUNNERS)
+    runner = input(f"Runner ({choices}, default cli): ").strip() or "cli"
+    if runner not in RUNNERS:
+        print("Invalid runner.")
+        return None
+    return runner
+
+
+def ask_quants() -> List[str]:
+    default = ",".join(SUPPORTED_QUANTS)
+    quants = ask_list(f"Quantisations (comma-separated, default {default}): ")
+    return quants or SUPPORTED_QUANTS
+
+
 def prepare_model_menu():
     print("\n--- Prepare model ---")
-    print("Model preparation is not implemented yet.\n")
-    print("This step will handle:")
-    print("- Hugging Face download")
-    print("- GGUF conversion")
-    print("- Quantisation\n")
+
+    model_id = input("Hugging Face model id (e.g. org/name): ").strip()
+    quants = ask_quants()
+
+    print("\n[INFO] Preparing model...\n")
+
+    try:
+        outputs = prepare_run(model_id, quants)
+    except Exception as e:
+        print(f"[ERROR] Model preparation failed: {e}")
+        return
+
+    print("\n--- Model ready ---")
+    for quant, path in outputs.items():
+        print(f"{quant:<8}: {path}")
+    print()
 
 
 def run_benchmark_menu():
@@ -77,49 +360,56 @@ def run_benchmark_menu():
     model_name = input("Model name (label for results): ").strip()
     model_path = Path(input("Path to GGUF model: ").strip())
 
-    try:
-        ngl_layers = int(
-            input("Number of GPU layers (-ngl, default 0): ").strip() or 0
-        )
-    except ValueError:
-        print("Invalid number for GPU layers.")
+    ngl_layers = ask_ngl("Number of GPU layers (-ngl, default 0): ")
+    if ngl_layers is None:
+        return
+
+    runner = ask_runner()
+    if runner is None:
         return
 
+    num_workers = 1
+    if runner == "cli":
+        try:
+            num_workers = int(
+                input("Parallel prompts (workers, default 1): ").strip() or 1
+            )
+        except ValueError:
+            print("Invalid number of workers.")
+            return
+
     print("\n[INFO] Running benchmark...\n")
 
     try:
-        results = run_llama_benchmark(
-            model_name=model_name,
-            model_path=str(model_path),
-            prompt_file=str(PROMPT_FILE),
-            llama_cli_path=str(LLAMA_CLI),
+        results = benchmark_run(
+            model_name,
+            model_path,
             ngl_layers=ngl_layers,
+            num_workers=num_workers,
+            runner=runner,
         )
     except Exception as e:
         print(f"[ERROR] Benchmark failed: {e}")
         return
 
-    file_exists = RESULTS_CSV.exists()
-
-    with open(RESULTS_CSV, "a", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=["Model", "PromptID", "Load_s", "Eval_s", "TPS"]
-        )
+    # One pass for both averages (llama-bench rows have no load time)
+    s_tps = s_load = 0.0
+    n_load = 0
+    for r in results:
+        s_tps += r["TPS"]
+        if r["Load_s"] is not None:
+            s_load += r["Load_s"]
+            n_load += 1
 
-        if not file_exists:
-            writer.writeheader()
-
-        for row in results:
-            writer.writerow(row)
-
-    avg_tps = sum(r["TPS"] for r in results) / len(results)
-    avg_load = sum(r["Load_s"] for r in results) / len(results)
+    avg_tps = s_tps / len(results)
 
     print("\n--- Benchmark completed ---")
     print(f"Model          : {model_name}")
     print(f"Prompts tested : {len(results)}")
-    print(f"Avg load time  : {avg_load:.2f} s")
+    if n_load:
+        print(f"Avg load time  : {s_load / n_load:.2f} s")
+    else:
+        print("Avg load time  : n/a")
     print(f"Avg TPS        : {avg_tps:.2f} tok/s")
     print(f"Results saved  : {RESULTS_CSV}\n")
 
@@ -129,10 +419,13 @@ def compute_ppl_menu():
 
     model_path = Path(input("Path to GGUF model: ").strip())
 
+    raw_ngl = input(
+        "Number of GPU layers (-ngl, default 0, 'auto' to fit VRAM): "
+    ).strip()
+    auto_ngl = raw_ngl.lower() == "auto"
+
     try:
-        ngl_layers = int(
-            input("Number of GPU layers (-ngl, default 0): ").strip() or 0
-        )
+        ngl_layers = 0 if auto_ngl else int(raw_ngl or 0)
     except ValueError:
         print("Invalid number for GPU layers.")
         return
@@ -140,48 +433,29 @@ def compute_ppl_menu():
     print("\n[INFO] Computing perplexity...\n")
 
     try:
-        ppl_value = compute_ppl(
-            model_path=model_path,
+        metrics = ppl_run(
+            model_path.name,
+            model_path,
             ngl_layers=ngl_layers,
+            auto_ngl=auto_ngl,
         )
     except Exception as e:
         print(f"[ERROR] PPL computation failed: {e}")
         return
 
-    file_exists = PPL_CSV.exists()
-
-    with open(PPL_CSV, "a", newline="", encoding="utf-8") as csvfile:
-        writer = csv.DictWriter(
-            csvfile,
-            fieldnames=["Model", "PPL"]
-        )
-
-        if not file_exists:
-            writer.writeheader()
-
-        writer.writerow({
-            "Model": model_path.name,
-            "PPL": ppl_value,
-        })
-
     print("\n--- Perplexity result ---")
     print(f"Model : {model_path.name}")
-    print(f"PPL   : {ppl_value:.4f}")
+    print(f"PPL   : {metrics['PPL']:.4f}")
+    if "Eval_s" in metrics:
+        print(f"Eval  : {metrics['Eval_s']:.1f} s")
     print(f"Saved : {PPL_CSV}\n")
 
 
 def generate_plots_menu():
     print("\n--- Generate plots ---")
 
-    if not RESULTS_CSV.exists():
-        print(f"[ERROR] Results file not found: {RESULTS_CSV}")
-        return
-
     try:
-        generate_basic_plots(
-            csv_path=RESULTS_CSV,
-            output_dir=DATA_DIR / "plots",
-        )
+        plots_run()
     except Exception as e:
         print(f"[ERROR] Plot generation failed: {e}")
         return
@@ -191,7 +465,131 @@ def generate_plots_menu():
 
 def full_pipeline_menu():
     print("\n--- Full pipeline ---")
-    print("Not implemented yet.\n")
+
+    model_ids = ask_list("Hugging Face model ids (comma-separated): ")
+    if not model_ids:
+        print("No models given.")
+        return
+
+    quants = ask_quants()
+
+    ngl_layers = ask_ngl("Number of GPU layers (-ngl, default 0): ")
+    if ngl_layers is None:
+        return
+
+    print("\n[INFO] Running full pipeline...\n")
+
+    try:
+        pipeline_run(model_ids, quants, ngl_layers=ngl_layers)
+    except Exception as e:
+        print(f"[ERROR] Pipeline failed: {e}")
+        return
+
+    print("[INFO] Full pipeline completed.\n")
+
+
+# ---------------------------
+# Command-line interface
+# ---------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=(
+            "LLM Edge Benchmark pipeline. Without arguments, starts the "
+            "interactive menu."
+        ),
+    )
+    parser.add_argument(
+        "--action",
+        required=True,
+        choices=["prepare", "bench", "ppl", "plots", "all"],
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=[],
+        help=(
+            "Hugging Face model ids for 'prepare' and 'all', "
+            "GGUF paths for 'bench' and 'ppl'"
+        ),
+    )
+    parser.add_argument(
+        "--quants",
+        nargs="+",
+        default=SUPPORTED_QUANTS,
+        choices=SUPPORTED_QUANTS,
+    )
+    parser.add_argument("--ngl", type=int, default=0)
+    parser.add_argument(
+        "--auto-ngl",
+        action="store_true",
+        help="offload as many layers as fit in VRAM (ppl only)",
+    )
+    parser.add_argument(
+        "--gpus",
+        nargs="+",
+        type=int,
+        default=[],
+        help="GPU indices to run 'ppl' on concurrently, one model per GPU",
+    )
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument(
+        "--runner",
+        choices=RUNNERS,
+        default="cli",
+        help="benchmark back-end for 'bench' and 'all'",
+    )
+    return parser
+
+
+def cli(argv: List[str]):
+    """
+    Run one pipeline action non-interactively.
+
+    Errors propagate (non-zero exit), so independent invocations can be
+    scripted and run in parallel, e.g. with xargs -P or GNU parallel.
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.action != "plots" and not args.models:
+        parser.error(f"--models is required for --action {args.action}")
+
+    if args.action == "prepare":
+        for model_id in args.models:
+            prepare_run(model_id, args.quants)
+
+    elif args.action == "bench":
+        for model in args.models:
+            path = Path(model)
+            benchmark_run(
+                path.stem,
+                path,
+                ngl_layers=args.ngl,
+                num_workers=args.num_workers,
+                runner=args.runner,
+            )
+
+    elif args.action == "ppl":
+        ppl_batch_run(
+            [Path(model) for model in args.models],
+            ngl_layers=args.ngl,
+            auto_ngl=args.auto_ngl,
+            gpus=args.gpus,
+        )
+
+    elif args.action == "plots":
+        plots_run()
+
+    elif args.action == "all":
+        pipeline_run(
+            args.models,
+            args.quants,
+            ngl_layers=args.ngl,
+            num_workers=args.num_workers,
+            runner=args.runner,
+        )
 
 
 # ---------------------------
@@ -222,4 +620,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+    else:
+        main()
@@ -9,16 +9,51 @@ Generates comparison plots across models:
 
 from pathlib import Path
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
+
+# Headless pipeline: select Agg explicitly instead of letting pyplot
+# autodetect (and initialise) an interactive GUI backend
+matplotlib.use("Agg")
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+# Compact column types: category for labels, float32 for metrics
+RESULTS_DTYPES = {
+    "Model": "category",
+    "Load_s": "float32",
+    "Eval_s": "float32",
+    "TPS": "float32",
+    "RuntimeRAM_MB": "float32",
+    "NumParams_B": "float32",
+}
+
+PPL_DTYPES = {
+    "Model": "category",
+    "PPL": "float32",
+}
 
 
 def generate_basic_plots(
-    results_csv: Path,
-    ppl_csv: Path,
+    results_csv: Path | None = None,
+    ppl_csv: Path | None = None,
+    *,
     output_dir: Path,
+    df_results: pd.DataFrame | None = None,
+    df_ppl: pd.DataFrame | None = None,
+    dpi: int = 150,
+    fmt: str = "png",
 ):
     """
     Generate comparison plots from benchmark and perplexity results.
+
+    Already-loaded DataFrames can be passed instead of CSV paths, so
+    callers that plot repeatedly parse each CSV only once.
+
+    Plots are saved at 150 dpi by default; pass dpi=300 for
+    publication-quality output (text rendering dominates save time).
+    fmt selects the file format, e.g. "svg" or "pdf" for vector output.
     """
 
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -27,8 +62,15 @@ def generate_basic_plots(
     # Load data
     # ---------------------------
 
-    df_results = pd.read_csv(results_csv)
-    df_ppl = pd.read_csv(ppl_csv)
+    if df_results is None:
+        if results_csv is None:
+            raise ValueError("Either results_csv or df_results is required.")
+        df_results = pd.read_csv(results_csv, dtype=RESULTS_DTYPES)
+
+    if df_ppl is None:
+        if ppl_csv is None:
+            raise ValueError("Either ppl_csv or df_ppl is required.")
+        df_ppl = pd.read_csv(ppl_csv, dtype=PPL_DTYPES)
 
     if df_results.empty or df_ppl.empty:
         raise ValueError("Input CSV files are empty.")
@@ -37,85 +79,96 @@ def generate_basic_plots(
     # Aggregate benchmark results
     # ---------------------------
 
-    bench = (
+    # Means go straight through the C groupby path; NumParams_B is a
+    # per-model constant, so take the first known value of each model.
+    means = (
         df_results
-        .groupby("Model", as_index=False)
-        .agg({
-            "TPS": "mean",
-            "RuntimeRAM_MB": "mean",
-            "NumParams_B": "first",
-        })
+        .groupby("Model", as_index=False, observed=True)
+        [["TPS", "RuntimeRAM_MB"]]
+        .mean()
     )
+    params = (
+        df_results[["Model", "NumParams_B"]]
+        .dropna(subset=["NumParams_B"])
+        .drop_duplicates("Model")
+    )
+    bench = means.merge(params, on="Model", how="left")
 
     data = bench.merge(df_ppl, on="Model", how="inner")
 
+    # One figure is reused for all plots (cleared after each save),
+    # so the canvas is set up once instead of three times. It is built
+    # through the object-oriented API, bypassing pyplot's global state.
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+
     # ---------------------------
     # Plot 1: PPL vs TPS
     # ---------------------------
 
-    plt.figure(figsize=(8, 6))
-    plt.scatter(data["TPS"], data["PPL"])
-
-    for _, row in data.iterrows():
-        plt.annotate(
-            row["Model"],
-            (row["TPS"], row["PPL"]),
-            fontsize=9,
-            alpha=0.8,
-        )
-
-    plt.xlabel("Tokens / second")
-    plt.ylabel("Perplexity")
-    plt.title("Perplexity vs Throughput")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(output_dir / "ppl_vs_tps.png", dpi=300)
-    plt.close()
+    ax = fig.add_subplot(111)
+    ax.scatter(data["TPS"], data["PPL"], rasterized=True)
+
+    for model, x, y in zip(
+        data["Model"].to_numpy(),
+        data["TPS"].to_numpy(),
+        data["PPL"].to_numpy(),
+    ):
+        ax.annotate(model, (x, y), fontsize=9, alpha=0.8)
+
+    ax.set_xlabel("Tokens / second")
+    ax.set_ylabel("Perplexity")
+    ax.set_title("Perplexity vs Throughput")
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(output_dir / f"ppl_vs_tps.{fmt}", dpi=dpi)
+    fig.clear()
 
     # ---------------------------
     # Plot 2: 1/PPL vs Runtime RAM
     # ---------------------------
 
-    plt.figure(figsize=(8, 6))
-    plt.scatter(data["RuntimeRAM_MB"], 1.0 / data["PPL"])
-
-    for _, row in data.iterrows():
-        plt.annotate(
-            row["Model"],
-            (row["RuntimeRAM_MB"], 1.0 / row["PPL"]),
-            fontsize=9,
-            alpha=0.8,
-        )
-
-    plt.xlabel("Runtime RAM (MB)")
-    plt.ylabel("1 / Perplexity")
-    plt.title("Accuracy vs Memory Footprint")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(output_dir / "inv_ppl_vs_ram.png", dpi=300)
-    plt.close()
+    ax = fig.add_subplot(111)
+    ax.scatter(
+        data["RuntimeRAM_MB"], 1.0 / data["PPL"], rasterized=True
+    )
+
+    for model, x, y in zip(
+        data["Model"].to_numpy(),
+        data["RuntimeRAM_MB"].to_numpy(),
+        1.0 / data["PPL"].to_numpy(),
+    ):
+        ax.annotate(model, (x, y), fontsize=9, alpha=0.8)
+
+    ax.set_xlabel("Runtime RAM (MB)")
+    ax.set_ylabel("1 / Perplexity")
+    ax.set_title("Accuracy vs Memory Footprint")
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(output_dir / f"inv_ppl_vs_ram.{fmt}", dpi=dpi)
+    fig.clear()
 
     # ---------------------------
     # Plot 3: Runtime RAM vs #Parameters
     # ---------------------------
 
-    plt.figure(figsize=(8, 6))
-    plt.scatter(data["NumParams_B"], data["RuntimeRAM_MB"])
-
-    for _, row in data.iterrows():
-        plt.annotate(
-            row["Model"],
-            (row["NumParams_B"], row["RuntimeRAM_MB"]),
-            fontsize=9,
-            alpha=0.8,
-        )
-
-    plt.xlabel("Number of Parameters (B)")
-    plt.ylabel("Runtime RAM (MB)")
-    plt.title("Model Size vs Memory Footprint")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(output_dir / "ram_vs_params.png", dpi=300)
-    plt.close()
+    ax = fig.add_subplot(111)
+    ax.scatter(
+        data["NumParams_B"], data["RuntimeRAM_MB"], rasterized=True
+    )
+
+    for model, x, y in zip(
+        data["Model"].to_numpy(),
+        data["NumParams_B"].to_numpy(),
+        data["RuntimeRAM_MB"].to_numpy(),
+    ):
+        ax.annotate(model, (x, y), fontsize=9, alpha=0.8)
+
+    ax.set_xlabel("Number of Parameters (B)")
+    ax.set_ylabel("Runtime RAM (MB)")
+    ax.set_title("Model Size vs Memory Footprint")
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(output_dir / f"ram_vs_params.{fmt}", dpi=dpi)
 
     print(f"[INFO] Plots saved to: {output_dir}")
@@ -6,12 +6,22 @@ Perplexity (PPL) evaluation utilities using llama-perplexity.
 - Relies on centralised paths defined in config.py
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import collections
+import functools
+import hashlib
+import json
+import os
+import queue
 import subprocess
 import re
+import shutil
+import tempfile
+import threading
 import urllib.request
 
-from config import CORPORA_DIR, LLAMA_PPL
+from config import CORPORA_DIR, LLAMA_PPL, PPL_CACHE
 
 
 # ---------------------------
@@ -25,49 +35,321 @@ WIKITEXT2_URL = (
 
 WIKITEXT2_PATH = CORPORA_DIR / "wikitext2" / "wiki.test.raw"
 
+# Sentinel written once the downloaded corpus has been verified
+WIKITEXT2_OK = WIKITEXT2_PATH.parent / ".ok"
+
+
+# ---------------------------
+# Output parsing
+# ---------------------------
+
+# One pattern for every reported metric, e.g.:
+# "perplexity = 12.3456"
+# "Final estimate: PPL = 12.3456 +/- 0.0789"
+# "llama_perf_context_print:        load time =  1234.56 ms"
+# "llama_perf_context_print: prompt eval time = 98765.43 ms / 4096 tokens"
+_METRICS_RE = re.compile(
+    r"\b(?P<key>perplexity|PPL|load time|prompt eval time)\s*=\s*"
+    r"(?P<val>[0-9]+(?:\.[0-9]+)?)"
+    r"(?:\s*\+/-\s*(?P<err>[0-9]+(?:\.[0-9]+)?)"
+    r"|\s*ms\s*/\s*(?P<tokens>[0-9]+)\s*tokens)?"
+)
+
+# Output lines kept for error reporting
+_TAIL_LINES = 256
+
+
+def _update_metrics(metrics: dict[str, float], m: re.Match) -> None:
+    """
+    Store one _METRICS_RE match; later values overwrite earlier ones.
+    """
+
+    key, val = m["key"], float(m["val"])
+
+    if key in ("perplexity", "PPL"):
+        metrics["PPL"] = val
+        if m["err"]:
+            metrics["PPL_err"] = float(m["err"])
+    elif key == "load time":
+        metrics["Load_s"] = val / 1000.0
+    else:
+        metrics["Eval_s"] = val / 1000.0
+        if m["tokens"]:
+            metrics["Tokens"] = int(m["tokens"])
+
 
 # ---------------------------
 # Corpus utilities
 # ---------------------------
 
+@functools.lru_cache(maxsize=1)
 def ensure_wikitext2_corpus() -> Path:
     """
     Ensure that the WikiText-2 raw test corpus exists locally.
     If not, download it from Hugging Face.
 
+    A download is checked once against the server's Content-Length
+    and marked with a sentinel; a file without the sentinel (e.g. left
+    truncated by an interrupted download) is fetched again. The result
+    is cached, so repeated calls in a sweep do not touch the filesystem
+    again.
+
     Returns:
         Path to the corpus file.
     """
 
-    if WIKITEXT2_PATH.exists():
+    if WIKITEXT2_OK.exists():
         return WIKITEXT2_PATH
 
-    print("[INFO] WikiText-2 corpus not found. Downloading...")
+    print("[INFO] WikiText-2 corpus not found or unverified. Downloading...")
 
     WIKITEXT2_PATH.parent.mkdir(parents=True, exist_ok=True)
 
     try:
-        urllib.request.urlretrieve(WIKITEXT2_URL, WIKITEXT2_PATH)
+        # Stream in 1 MiB chunks rather than urlretrieve's 8 KiB blocks
+        with urllib.request.urlopen(WIKITEXT2_URL) as response, \
+                open(WIKITEXT2_PATH, "wb") as f:
+            expected = response.headers.get("Content-Length")
+            shutil.copyfileobj(response, f, length=1 << 20)
+            written = f.tell()
     except Exception as e:
         raise RuntimeError(
             f"Failed to download WikiText-2 corpus: {e}"
         )
 
+    if expected is not None and written != int(expected):
+        WIKITEXT2_PATH.unlink(missing_ok=True)
+        raise RuntimeError(
+            f"WikiText-2 download incomplete: {written} of "
+            f"{expected} bytes."
+        )
+
+    WIKITEXT2_OK.touch()
+
     print("[INFO] WikiText-2 corpus downloaded successfully.")
     return WIKITEXT2_PATH
 
 
+# ---------------------------
+# Results cache
+# ---------------------------
+# Already computed values are stored in PPL_CACHE, so reruns of a sweep
+# skip models whose file, corpus and settings are unchanged. Delete the
+# file to force recomputation.
+
+_cache_lock = threading.Lock()
+
+
+def _cache_key(
+    model_path: Path,
+    corpus_path: Path,
+    context_size: int,
+    batch_size: int,
+) -> str:
+    """
+    Identify a run by file identity (path, size, mtime) of the model,
+    the corpus and the llama-perplexity binary, plus the settings.
+
+    Size + mtime is used instead of hashing multi-GB model contents.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+
+    # A rebuilt llama.cpp can change results, so the binary is included
+    for path in (model_path, corpus_path, LLAMA_PPL):
+        st = path.stat()
+        h.update(f"{path.resolve()}|{st.st_size}|{st.st_mtime_ns}|".encode())
+
+    h.update(f"{context_size}|{batch_size}".encode())
+    return h.hexdigest()
+
+
+def _load_cache() -> dict[str, dict[str, float]]:
+    try:
+        with open(PPL_CACHE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _store_cache(key: str, value: dict[str, float]) -> None:
+    """
+    Add one entry to the cache file, replacing it atomically.
+    """
+
+    with _cache_lock:
+        cache = _load_cache()
+        cache[key] = value
+
+        PPL_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=PPL_CACHE.parent,
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            json.dump(cache, f, indent=2)
+
+        os.replace(f.name, PPL_CACHE)
+
+
+# ---------------------------
+# GPU offload
+# ---------------------------
+
+# VRAM left free for the KV cache and compute buffers
+_VRAM_MARGIN_BYTES = 1024 * 1024 * 1024
+
+
+def _free_vram_bytes(gpu: int | None = None) -> int:
+    """
+    Free memory on an NVIDIA GPU (default: the first), or 0 if none
+    is available.
+    """
+
+    cmd = [
+        "nvidia-smi",
+        "--query-gpu=memory.free",
+        "--format=csv,noheader,nounits",
+    ]
+
+    if gpu is not None:
+        cmd.extend(["-i", str(gpu)])
+
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return int(result.stdout.splitlines()[0]) * 1024 * 1024
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return 0
+
+
+def _auto_ngl(model_path: Path, gpu: int | None = None) -> int:
+    """
+    Estimate how many layers of a GGUF model fit in free GPU memory.
+
+    Layer size is approximated as file size / block count, read from
+    the GGUF header.
+    """
+
+    free = _free_vram_bytes(gpu) - _VRAM_MARGIN_BYTES
+    if free <= 0:
+        return 0
+
+    # Deferred: gguf pulls in numpy and is only needed here
+    from gguf import GGUFReader
+
+    reader = GGUFReader(model_path)
+    arch_field = reader.fields["general.architecture"]
+    arch = bytes(arch_field.parts[arch_field.data[0]]).decode("utf-8")
+    count_field = reader.fields[f"{arch}.block_count"]
+    n_layers = int(count_field.parts[count_field.data[0]][0])
+
+    per_layer = model_path.stat().st_size / n_layers
+    return max(0, min(n_layers, int(free // per_layer)))
+
+
 # ---------------------------
 # Perplexity computation
 # ---------------------------
 
+def _run_ppl(
+    model_path: Path,
+    corpus_path: Path,
+    *,
+    context_size: int,
+    batch_size: int,
+    ngl_layers: int,
+    auto_ngl: bool = False,
+    gpu: int | None = None,
+) -> dict[str, float]:
+    """
+    Run llama-perplexity on one model and parse its metrics.
+
+    If gpu is given, the process only sees that device. Cached results
+    are returned without running the binary.
+    """
+
+    key = _cache_key(model_path, corpus_path, context_size, batch_size)
+    cached = _load_cache().get(key)
+    if isinstance(cached, dict):
+        print(f"[INFO] Using cached perplexity for {model_path.name}")
+        return cached
+
+    env = None
+    if gpu is not None:
+        # PCI order, so the index matches nvidia-smi's numbering
+        env = {
+            **os.environ,
+            "CUDA_DEVICE_ORDER": "PCI_BUS_ID",
+            "CUDA_VISIBLE_DEVICES": str(gpu),
+        }
+
+    if auto_ngl and ngl_layers == 0:
+        ngl_layers = _auto_ngl(model_path, gpu)
+        print(f"[INFO] Auto GPU offload: -ngl {ngl_layers}")
+
+    cmd = [
+        str(LLAMA_PPL),
+        "-m", str(model_path),
+        "-f", str(corpus_path),
+        "-c", str(context_size),
+        "-b", str(batch_size),
+    ]
+
+    if ngl_layers > 0:
+        cmd.extend(["-ngl", str(ngl_layers)])
+
+    # Stream the (possibly multi-MB) output line by line instead of
+    # buffering it: only the parsed metrics and a short tail for error
+    # reporting are kept.
+    tail = collections.deque(maxlen=_TAIL_LINES)
+    metrics = {}
+
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        encoding="utf-8",
+        errors="ignore",
+        bufsize=1,
+        env=env,
+    ) as proc:
+        for line in proc.stdout:
+            tail.append(line)
+            # Every metric line is an assignment; skip the rest cheaply
+            if "=" in line:
+                for m in _METRICS_RE.finditer(line):
+                    _update_metrics(metrics, m)
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, output="".join(tail)
+        )
+
+    if "PPL" not in metrics:
+        raise RuntimeError(
+            "Unable to parse perplexity from llama-perplexity output."
+        )
+
+    _store_cache(key, metrics)
+    return metrics
+
+
 def compute_ppl(
     model_path: Path,
     *,
     context_size: int = 2048,
     batch_size: int = 256,
     ngl_layers: int = 0,
-) -> float:
+    auto_ngl: bool = False,
+) -> dict[str, float]:
     """
     Compute perplexity for a GGUF model using llama-perplexity.
 
@@ -76,9 +358,12 @@ def compute_ppl(
         context_size: Context window size.
         batch_size: Batch size.
         ngl_layers: Number of GPU layers.
+        auto_ngl: If ngl_layers is 0, offload as many layers as fit
+            in free GPU memory.
 
     Returns:
-        Perplexity value (float).
+        Metrics dictionary: PPL, plus PPL_err, Load_s, Eval_s and
+        Tokens when llama-perplexity reports them.
     """
 
     if not LLAMA_PPL.exists():
@@ -89,38 +374,129 @@ def compute_ppl(
 
     corpus_path = ensure_wikitext2_corpus()
 
-    cmd = [
-        str(LLAMA_PPL),
-        "-m", str(model_path),
-        "-f", str(corpus_path),
-        "-c", str(context_size),
-        "-b", str(batch_size),
-    ]
+    return _run_ppl(
+        model_path,
+        corpus_path,
+        context_size=context_size,
+        batch_size=batch_size,
+        ngl_layers=ngl_layers,
+        auto_ngl=auto_ngl,
+    )
 
-    if ngl_layers > 0:
-        cmd.extend(["-ngl", str(ngl_layers)])
 
-    result = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="ignore",
-        check=True,
-    )
+def _check_models(model_paths: list[Path]) -> None:
+    """
+    Check the binary and every model path before a multi-model run.
+    """
 
-    output = result.stdout + result.stderr
+    if not LLAMA_PPL.exists():
+        raise RuntimeError(f"llama-perplexity not found at {LLAMA_PPL}")
 
-    # Expected output line (example):
-    # "perplexity = 12.3456"
-    match = re.search(
-        r"\bperplexity\s*=\s*([0-9]+(?:\.[0-9]+)?)\b",
-        output,
-    )
+    missing = [p for p in model_paths if not p.exists()]
+    if missing:
+        raise FileNotFoundError(
+            "Model not found: " + ", ".join(str(p) for p in missing)
+        )
 
-    if not match:
-        raise RuntimeError(
-            "Unable to parse perplexity from llama-perplexity output."
+
+def compute_ppl_batch(
+    model_paths: list[Path],
+    *,
+    context_size: int = 2048,
+    batch_size: int = 256,
+    ngl_layers: int = 0,
+    auto_ngl: bool = False,
+) -> dict[Path, dict[str, float]]:
+    """
+    Compute perplexity for several GGUF models (e.g. a quantisation sweep).
+
+    Setup is done once for the whole batch: the binary and every model
+    path are checked up front (so a typo fails before hours of work),
+    and the corpus is resolved a single time.
+
+    Args:
+        model_paths: Paths to the GGUF models.
+        context_size: Context window size.
+        batch_size: Batch size.
+        ngl_layers: Number of GPU layers.
+        auto_ngl: If ngl_layers is 0, offload as many layers as fit
+            in free GPU memory (estimated per model).
+
+    Returns:
+        Mapping from model path to its metrics dictionary.
+    """
+
+    _check_models(model_paths)
+    corpus_path = ensure_wikitext2_corpus()
+
+    return {
+        model_path: _run_ppl(
+            model_path,
+            corpus_path,
+            context_size=context_size,
+            batch_size=batch_size,
+            ngl_layers=ngl_layers,
+            auto_ngl=auto_ngl,
         )
+        for model_path in model_paths
+    }
+
+
+def compute_ppl_many(
+    model_paths: list[Path],
+    gpus: list[int],
+    *,
+    context_size: int = 2048,
+    batch_size: int = 256,
+    ngl_layers: int = 0,
+    auto_ngl: bool = False,
+) -> dict[Path, dict[str, float]]:
+    """
+    Compute perplexity for several GGUF models concurrently, one per GPU.
+
+    Each llama-perplexity run is pinned to a single free GPU through
+    CUDA_VISIBLE_DEVICES; a GPU is handed to the next model only once
+    its previous run has finished.
+
+    Args:
+        model_paths: Paths to the GGUF models.
+        gpus: Indices of the GPUs to use.
+        context_size: Context window size.
+        batch_size: Batch size.
+        ngl_layers: Number of GPU layers.
+        auto_ngl: If ngl_layers is 0, offload as many layers as fit
+            in free memory of the assigned GPU.
+
+    Returns:
+        Mapping from model path to its metrics dictionary.
+    """
+
+    if not gpus:
+        raise ValueError("At least one GPU index is required.")
+
+    _check_models(model_paths)
+    corpus_path = ensure_wikitext2_corpus()
+
+    free_gpus = queue.Queue()
+    for gpu in gpus:
+        free_gpus.put(gpu)
+
+    def run(model_path: Path) -> dict[str, float]:
+        gpu = free_gpus.get()
+        try:
+            return _run_ppl(
+                model_path,
+                corpus_path,
+                context_size=context_size,
+                batch_size=batch_size,
+                ngl_layers=ngl_layers,
+                auto_ngl=auto_ngl,
+                gpu=gpu,
+            )
+        finally:
+            free_gpus.put(gpu)
+
+    with ThreadPoolExecutor(max_workers=len(gpus)) as ex:
+        values = list(ex.map(run, model_paths))
 
-    return float(match.group(1))
+    return dict(zip(model_paths, values))